@@ -1,15 +1,86 @@
+import os
+
+def container_cpu_quota():
+    """Whole CPUs allowed by the cgroup CPU quota (v2 cpu.max or v1 CFS), or None when unlimited"""
+    for quota_file, period_file in (
+        ("/sys/fs/cgroup/cpu.max", None),
+        ("/sys/fs/cgroup/cpu/cpu.cfs_quota_us", "/sys/fs/cgroup/cpu/cpu.cfs_period_us"),
+    ):
+        try:
+            with open(quota_file) as f:
+                values = f.read().split()
+            if period_file is not None:
+                with open(period_file) as f:
+                    values.append(f.read().strip())
+            quota, period = values[0], values[1]
+            if quota in ("max", "-1"):
+                return None
+            return max(1, int(quota) // int(period))
+        except (OSError, ValueError, IndexError):
+            continue
+    return None
+
+# --- CPU THREADING: OpenMP/MKL read these once at import, so set them before torch loads ---
+# Explicit TORCH_NUM_THREADS wins, then the container CPU quota; with neither, torch's default
+# (one thread per physical core) is left alone
+TORCH_NUM_THREADS = int(os.environ["TORCH_NUM_THREADS"]) if os.getenv("TORCH_NUM_THREADS") else container_cpu_quota()
+if TORCH_NUM_THREADS is not None:
+    os.environ.setdefault("OMP_NUM_THREADS", str(TORCH_NUM_THREADS))
+    os.environ.setdefault("MKL_NUM_THREADS", str(TORCH_NUM_THREADS))
+# Only Intel OpenMP (shipped with IPEX) reads this; the stock torch wheel uses libgomp and ignores it
+os.environ.setdefault("KMP_AFFINITY", "granularity=fine,compact,1,0")
+
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 import pandas as pd
+import numpy as np
 import torch
 import joblib
-from transformers import BertTokenizer, BertForSequenceClassification
+from transformers import BertConfig, BertModel, BertTokenizerFast, BertForSequenceClassification
+from safetensors import safe_open
 import google.generativeai as genai
-import os
+import asyncio
+import hashlib
+import json
+import re
+import shutil
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, aclosing, asynccontextmanager
+from functools import lru_cache, reduce
 from typing import Optional, List
+from cachetools import LRUCache, TTLCache
+
+try:
+    import intel_extension_for_pytorch as ipex
+except ImportError:
+    ipex = None
+
+# BF16 kernels are only worth it through IPEX (oneDNN fusions, AMX/AVX-512 BF16)
+USE_BF16 = ipex is not None
+MODEL_DTYPE = torch.bfloat16 if USE_BF16 else torch.float32
 
-app = FastAPI(title="MediCure API", version="1.0.0")
+# --- APP LIFESPAN: load models, start batching loops, stop them on shutdown ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await load_models()
+
+    for model_key in BATCHED_MODELS:
+        if models_cache.get(model_key) is not None:
+            batch_queues[model_key] = asyncio.Queue()
+            batch_tasks.append(asyncio.create_task(batch_loop(batch_queues[model_key], model_key)))
+    print(f"✓ Batching loops started for: {list(batch_queues.keys())}")
+
+    yield
+
+    for task in batch_tasks:
+        task.cancel()
+    await asyncio.gather(*batch_tasks, return_exceptions=True)
+    ml_executor.shutdown(wait=True)
+
+app = FastAPI(title="MediCure API", version="1.0.0", lifespan=lifespan)
 
 # --- CORS CONFIGURATION (Allow all origins for debugging) ---
 app.add_middleware(
@@ -23,6 +94,86 @@ app.add_middleware(
 # --- GLOBAL CACHE FOR MODELS ---
 models_cache = {}
 
+# --- DYNAMIC BATCHING SETTINGS ---
+MAX_BATCH_SIZE = 8
+MAX_BATCH_DELAY = 0.05  # seconds to wait for more requests before running a batch
+MAX_SEQ_LENGTH = 32  # medicine names are well under 10 tokens
+
+# Model key -> label encoder key, one batching queue per model
+BATCHED_MODELS = {"pred_model": "le_pred", "side_model": "le_side", "sub_model": "le_sub"}
+batch_queues = {}
+batch_tasks = []
+
+# All model forward passes run on this one thread so they never block the event
+# loop and never compete with each other for torch's intra-op threads
+# (grad mode is thread-local, so autograd is switched off in the worker itself)
+ml_executor = ThreadPoolExecutor(
+    max_workers=1,
+    thread_name_prefix="ml-worker",
+    initializer=torch.set_grad_enabled,
+    initargs=(False,),
+)
+
+# --- RESPONSE CACHES ---
+gemini_cache = TTLCache(maxsize=10_000, ttl=600)
+classify_cache = TTLCache(maxsize=10_000, ttl=600)
+inflight_locks = {}  # key -> [asyncio.Lock, refcount]
+_MISSING = object()
+
+# --- GEMINI PROMPTS & PARSING ---
+GEMINI_MODEL = "gemini-2.0-flash-exp"
+
+CHAT_CONTEXT = """
+        You are an AI medical assistant (not a doctor).
+        Provide:
+        - Likely diseases (max 2)
+        - Suggested diet
+        - Recommended workouts
+        - Precautions
+        End with: "Consult a doctor for professional advice."
+        """
+
+SIMPLIFIER_PROMPT = """
+You are a medical content simplifier. You will receive a health issue, a number N and N home remedies from a traditional database.
+Your task: Rewrite these remedies to be:
+- Clear and concise (one sentence each)
+- Easy to understand
+- Action-oriented (start with verbs like "Drink", "Apply", "Mix", etc.)
+- Keep the same meaning and ingredients
+
+Return EXACTLY N simplified remedies in this format:
+1. [simplified remedy 1]
+2. [simplified remedy 2]
+3. [simplified remedy 3]
+...
+
+DO NOT add extra remedies. DO NOT add explanations. Just the numbered list.
+"""
+
+# List numbering or bullet at the start of a line: "1.", "10)", "-", "•", "*"
+NUMBERING_PREFIX = re.compile(r"^\s*(?:\d+[.)]|[-•*])\s*")
+
+# --- Shared Encoder Heads ---
+class SharedEncoderHead(torch.nn.Module):
+    """Classifier head over an encoder shared between tasks; pooled outputs are cached per input"""
+
+    def __init__(self, encoder, head, pooled_cache):
+        super().__init__()
+        self.encoder = encoder
+        self.head = head
+        self.pooled_cache = pooled_cache
+
+    def forward(self, input_ids, attention_mask):
+        keys = [row.numpy().tobytes() for row in input_ids]
+        rows = [self.pooled_cache.get(key) for key in keys]
+        missing = [i for i, row in enumerate(rows) if row is None]
+        if missing:
+            pooled = self.encoder(input_ids[missing], attention_mask[missing])[1]
+            for i, row in zip(missing, pooled):
+                rows[i] = row.clone()
+                self.pooled_cache[keys[i]] = rows[i]
+        return (self.head(torch.stack(rows)),)
+
 # --- Pydantic Models ---
 class MedicineRequest(BaseModel):
     medicine_name: str
@@ -39,30 +190,88 @@ class RemedyItem(BaseModel):
     yoga_link: Optional[str] = None
 
 # --- STARTUP: LOAD MODELS & DATA ---
-@app.on_event("startup")
 async def load_models():
     print("🚀 Loading models and data...")
 
+    # Inference only: size torch's intra-op pool once and never track gradients
+    if TORCH_NUM_THREADS is not None:
+        torch.set_num_threads(TORCH_NUM_THREADS)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError as e:
+        print(f"⚠ Warning: Could not set inter-op threads: {e}")
+    torch.set_grad_enabled(False)
+    print(f"✓ Torch using {torch.get_num_threads()} threads")
+
     try:
         # Load tokenizer
-        tokenizer = BertTokenizer.from_pretrained("bert-base-uncased")
+        tokenizer = BertTokenizerFast.from_pretrained("bert-base-uncased")
         models_cache["tokenizer"] = tokenizer
         print("✓ Tokenizer loaded")
 
         # --- Load Fine-tuned Models ---
         def load_model(model_name, num_labels, path):
             try:
-                model = BertForSequenceClassification.from_pretrained("bert-base-uncased", num_labels=num_labels)
-                model.load_state_dict(torch.load(path, map_location="cpu"))
+                # Without IPEX BF16, Linear layers run as dynamic int8; the traced result is saved for later boots
+                # The torch version is part of the name since TorchScript archives aren't portable across releases
+                quantized_path = f"{os.path.splitext(path)[0]}.int8-{MAX_SEQ_LENGTH}-torch{torch.__version__}.pt"
+                if not USE_BF16 and is_fresh(quantized_path, path):
+                    try:
+                        model = torch.jit.load(quantized_path, map_location="cpu")
+                        print(f"✓ {model_name} model loaded from {quantized_path}")
+                        return model
+                    except Exception as e:
+                        print(f"⚠ Warning: Could not load {quantized_path}, rebuilding: {e}")
+
+                # Load straight from an HF-format copy of the checkpoint, without random init or a second copy of the weights
+                hf_dir = export_hf_checkpoint(path, num_labels)
+                model = None
+                if hf_dir is not None:
+                    try:
+                        model, loading_info = BertForSequenceClassification.from_pretrained(
+                            hf_dir,
+                            torchscript=True,
+                            torch_dtype=MODEL_DTYPE,
+                            low_cpu_mem_usage=True,
+                            output_loading_info=True,
+                        )
+                        check_loading_info(hf_dir, loading_info)
+                    except Exception as e:
+                        # Remove the unreadable export so the next boot writes a fresh one
+                        print(f"⚠ Warning: Could not load {hf_dir}/, removing it and loading {path} in memory: {e}")
+                        shutil.rmtree(hf_dir, ignore_errors=True)
+                        model = None
+                if model is None:
+                    model = model_from_state_dict(path, num_labels, torchscript=True, torch_dtype=MODEL_DTYPE)
                 model.eval()
+                if not USE_BF16:
+                    model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+                model = optimize_model(model_name, model)
+                if not USE_BF16 and isinstance(model, torch.jit.ScriptModule):
+                    try:
+                        # Write then rename, so an interrupted save never leaves a truncated archive
+                        torch.jit.save(model, f"{quantized_path}.tmp")
+                        os.replace(f"{quantized_path}.tmp", quantized_path)
+                        print(f"✓ {model_name} model cached to {quantized_path}")
+                    except Exception as e:
+                        print(f"⚠ Warning: Could not write {quantized_path}: {e}")
                 return model
             except Exception as e:
                 print(f"⚠ Warning: Could not load {model_name} model: {e}")
                 return None
 
-        models_cache["pred_model"] = load_model("prediction", 583, "bert_finetuned_model_prediction.pkl")
-        models_cache["side_model"] = load_model("side_effects", 1271, "bert_finetuned_model_sideffects.pkl")
-        models_cache["sub_model"] = load_model("substitute", 43297, "bert_finetuned_model_substitute.pkl")
+        model_specs = {
+            "pred_model": ("prediction", 583, "bert_finetuned_model_prediction.pkl"),
+            "side_model": ("side_effects", 1271, "bert_finetuned_model_sideffects.pkl"),
+            "sub_model": ("substitute", 43297, "bert_finetuned_model_substitute.pkl"),
+        }
+        shared_models = load_shared_encoder_models(model_specs)
+        for model_key, (model_name, num_labels, path) in model_specs.items():
+            if model_key in shared_models:
+                models_cache[model_key] = shared_models[model_key]
+            else:
+                models_cache[model_key] = load_model(model_name, num_labels, path)
 
         # --- Load Label Encoders ---
         try:
@@ -75,29 +284,52 @@ async def load_models():
 
         # --- Load Home Remedies Data ---
         try:
-            # Try different encodings
-            for encoding in ["utf-8", "latin-1", "ISO-8859-1", "cp1252"]:
+            # Parquet fast path, written from the CSV on first boot (rebuilt if the CSV is newer)
+            csv_path, parquet_path = "Home Remedies.csv", "Home Remedies.parquet"
+            df = None
+            if is_fresh(parquet_path, csv_path):
                 try:
-                    df = pd.read_csv("Home Remedies.csv", encoding=encoding)
-                    print(f"✓ Home Remedies loaded with {encoding} encoding")
-                    break
-                except UnicodeDecodeError:
-                    continue
-            
-            # Clean and normalize data
-            df["Health Issue"] = df["Health Issue"].str.strip().str.lower()
-            df["Home Remedy"] = df["Home Remedy"].str.strip()
-            df["Yogasan"] = df["Yogasan"].fillna("")
-            
+                    df = pd.read_parquet(parquet_path, memory_map=True)
+                    print("✓ Home Remedies loaded from Parquet")
+                except Exception as e:
+                    print(f"⚠ Warning: Could not read {parquet_path}, rebuilding from CSV: {e}")
+
+            if df is None:
+                # Try different encodings
+                for encoding in ["utf-8", "latin-1", "ISO-8859-1", "cp1252"]:
+                    try:
+                        df = pd.read_csv(csv_path, encoding=encoding)
+                        print(f"✓ Home Remedies loaded with {encoding} encoding")
+                        break
+                    except UnicodeDecodeError:
+                        continue
+
+                # Clean and normalize data
+                df["Health Issue"] = df["Health Issue"].str.strip().str.lower().astype("category")
+                df["Home Remedy"] = df["Home Remedy"].str.strip()
+                df["Yogasan"] = df["Yogasan"].fillna("")
+
+                try:
+                    # Write then rename, so an interrupted write never leaves a partial cache behind
+                    df.to_parquet(f"{parquet_path}.tmp", index=False)
+                    os.replace(f"{parquet_path}.tmp", parquet_path)
+                    print(f"✓ Home Remedies cached to {parquet_path}")
+                except Exception as e:
+                    print(f"⚠ Warning: Could not write {parquet_path}: {e}")
+
             models_cache["remedy_df"] = df
             print(f"✓ Home Remedies loaded ({len(df)} rows)")
             print(f"📋 Sample health issues: {df['Health Issue'].head(10).tolist()}")
-            
+
         except Exception as e:
             print(f"❌ Error loading Home Remedies CSV: {e}")
             # Create empty dataframe as fallback
             models_cache["remedy_df"] = pd.DataFrame(columns=["Health Issue", "Home Remedy", "Yogasan"])
 
+        # Precompute lookup indexes so searches are hash lookups instead of column scans
+        build_remedy_indexes(models_cache["remedy_df"])
+        print(f"✓ Remedy indexes built ({len(models_cache['remedy_exact_idx'])} issues, {len(models_cache['remedy_word_idx'])} words)")
+
         # --- Configure Gemini AI ---
         api_key = os.getenv("GEMINI_API_KEY")
         if not api_key:
@@ -107,11 +339,27 @@ async def load_models():
         else:
             try:
                 genai.configure(api_key=api_key)
-                models_cache["gemini_model"] = genai.GenerativeModel("gemini-2.0-flash-exp")
+                models_cache["gemini_model"] = genai.GenerativeModel(GEMINI_MODEL)
                 print("✓ Gemini AI configured")
             except Exception as e:
                 print(f"⚠ Warning: Gemini AI configuration failed: {e}")
 
+            # The simplifier's fixed instructions live in a system instruction, so each call only sends its data
+            try:
+                models_cache["simplifier_model"] = genai.GenerativeModel(GEMINI_MODEL, system_instruction=SIMPLIFIER_PROMPT)
+            except Exception as e:
+                print(f"⚠ Warning: Gemini simplifier configuration failed: {e}")
+
+        # --- Warm Up ---
+        # Run the first forwards and open the Gemini connection now rather than on the first user request
+        await asyncio.get_running_loop().run_in_executor(ml_executor, warmup_models)
+        if models_cache.get("gemini_model") is not None:
+            try:
+                await models_cache["gemini_model"].count_tokens_async("ping")
+                print("✓ Gemini connection warmed up")
+            except Exception as e:
+                print(f"⚠ Warning: Gemini warmup failed: {e}")
+
         print("✅ All models and data loaded successfully!\n")
 
     except Exception as e:
@@ -119,60 +367,344 @@ async def load_models():
         # Don't raise - allow API to start even if some models fail
 
 # --- UTILITY FUNCTIONS ---
-def classify_text(model, tokenizer, label_encoder, text):
+def is_fresh(cache_path: str, source_path: str) -> bool:
+    """True if cache_path exists and is not older than source_path (or the source is gone)"""
+    if not os.path.exists(cache_path):
+        return False
+    return not os.path.exists(source_path) or os.path.getmtime(cache_path) >= os.path.getmtime(source_path)
+
+def issue_words(text: str) -> List[str]:
+    """Split a normalized issue or query into words, dropping punctuation ("acne," -> "acne")"""
+    return re.findall(r"\w+", text)
+
+def build_remedy_indexes(df: pd.DataFrame):
+    """Map each normalized health issue, and each word in it, to its row positions in df"""
+    exact_idx = df.groupby("Health Issue", sort=False, observed=True).indices
+
+    word_rows = defaultdict(list)
+    for issue, rows in exact_idx.items():
+        for word in set(issue_words(str(issue))):
+            word_rows[word].extend(rows.tolist())
+
+    models_cache["remedy_exact_idx"] = exact_idx
+    models_cache["remedy_word_idx"] = {w: np.unique(r) for w, r in word_rows.items()}
+    # Distinct issues as a fixed-width string array (plus their rows) for substring search
+    models_cache["remedy_issues_np"] = np.array([str(issue) for issue in exact_idx], dtype=np.str_)
+    models_cache["remedy_issue_rows"] = list(exact_idx.values())
+
+def find_issue_rows(term: str) -> np.ndarray:
+    """Sorted row positions of every health issue containing term as a substring"""
+    hits = np.flatnonzero(np.char.find(models_cache["remedy_issues_np"], term) >= 0)
+    if not hits.size:
+        return hits
+    issue_rows = models_cache["remedy_issue_rows"]
+    return np.sort(np.concatenate([issue_rows[i] for i in hits]))
+
+def check_loading_info(source: str, loading_info: dict, ignore: tuple = ()):
+    """Fail like a strict load_state_dict if from_pretrained left weights missing, unused or mis-shaped"""
+    problems = {
+        kind: keys
+        for kind, keys in loading_info.items()
+        if kind in ("missing_keys", "unexpected_keys", "mismatched_keys") and kind not in ignore and keys
+    }
+    if problems:
+        raise ValueError(f"{source} does not match the model architecture: {problems}")
+
+def model_from_state_dict(path: str, num_labels: int, torchscript: bool = False, torch_dtype=None):
+    """Build a classifier directly from a fine-tuned state dict .pkl, without random init"""
+    config = BertConfig.from_pretrained("bert-base-uncased", num_labels=num_labels, torchscript=torchscript)
+    model, loading_info = BertForSequenceClassification.from_pretrained(
+        None,
+        config=config,
+        state_dict=torch.load(path, map_location="cpu"),
+        torch_dtype=torch_dtype,
+        low_cpu_mem_usage=True,
+        output_loading_info=True,
+    )
+    check_loading_info(path, loading_info)
+    return model
+
+def export_hf_checkpoint(path: str, num_labels: int) -> Optional[str]:
+    """Convert a fine-tuned state dict .pkl into an HF model directory once; None if it can't be written"""
+    hf_dir = os.path.splitext(path)[0]
+    # Exports are built in a temp directory and renamed into place, so hf_dir only ever holds a complete one
+    if is_fresh(os.path.join(hf_dir, "model.safetensors"), path):
+        return hf_dir
+
+    # e.g. a read-only /app when the container runs as a non-root user
+    if not os.access(os.path.dirname(os.path.abspath(hf_dir)), os.W_OK):
+        print(f"⚠ Warning: Cannot write {hf_dir}/, loading {path} in memory")
+        return None
+
+    model = model_from_state_dict(path, num_labels)
+    tmp_dir = f"{hf_dir}.tmp"
+    try:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        model.save_pretrained(tmp_dir)
+        # A directory can't be renamed over a non-empty one, so drop any stale export first
+        shutil.rmtree(hf_dir, ignore_errors=True)
+        os.replace(tmp_dir, hf_dir)
+    except Exception as e:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        print(f"⚠ Warning: Could not export {path} to {hf_dir}/, loading it in memory: {e}")
+        return None
+    print(f"✓ Exported {path} to {hf_dir}/")
+    return hf_dir
+
+def encoders_match(hf_dirs: List[str]) -> bool:
+    """True if every exported checkpoint has identical 'bert.*' encoder weights; stops at the first difference"""
+    with ExitStack() as stack:
+        files = [stack.enter_context(safe_open(os.path.join(d, "model.safetensors"), framework="pt")) for d in hf_dirs]
+        reference, others = files[0], files[1:]
+        other_keys = [set(f.keys()) for f in others]
+        for name in reference.keys():
+            if not name.startswith("bert."):
+                continue
+            tensor = reference.get_tensor(name)
+            for f, keys in zip(others, other_keys):
+                if name not in keys or not torch.equal(tensor, f.get_tensor(name)):
+                    return False
+    return True
+
+def load_shared_encoder_models(model_specs: dict) -> dict:
+    """Load one encoder plus a head per task when all checkpoints share the same encoder, else return {}"""
+    try:
+        hf_dirs = {key: export_hf_checkpoint(path, num_labels) for key, (_, num_labels, path) in model_specs.items()}
+        if any(hf_dir is None for hf_dir in hf_dirs.values()):
+            print("ℹ Checkpoints not exported, loading separate models")
+            return {}
+        if not encoders_match(list(hf_dirs.values())):
+            print("ℹ Fine-tuned encoders differ, loading separate models")
+            return {}
+
+        encoder_dir = next(iter(hf_dirs.values()))
+        encoder, loading_info = BertModel.from_pretrained(
+            encoder_dir,
+            torchscript=True,
+            torch_dtype=MODEL_DTYPE,
+            low_cpu_mem_usage=True,
+            output_loading_info=True,
+        )
+        # The classifier weights in the checkpoint are expected to go unused here
+        check_loading_info(encoder_dir, loading_info, ignore=("unexpected_keys",))
+        encoder.eval()
+        if not USE_BF16:
+            encoder = torch.ao.quantization.quantize_dynamic(encoder, {torch.nn.Linear}, dtype=torch.qint8)
+        encoder = optimize_model("shared encoder", encoder)
+
+        pooled_cache = LRUCache(maxsize=4096)
+        models = {}
+        for key, hf_dir in hf_dirs.items():
+            with safe_open(os.path.join(hf_dir, "model.safetensors"), framework="pt") as f:
+                weight = f.get_tensor("classifier.weight").to(MODEL_DTYPE)
+                bias = f.get_tensor("classifier.bias").to(MODEL_DTYPE)
+            head = torch.nn.Sequential(torch.nn.Linear(weight.shape[1], weight.shape[0], dtype=MODEL_DTYPE))
+            head.load_state_dict({"0.weight": weight, "0.bias": bias})
+            head.eval()
+            if not USE_BF16:
+                head = torch.ao.quantization.quantize_dynamic(head, {torch.nn.Linear}, dtype=torch.qint8)
+            models[key] = SharedEncoderHead(encoder, head, pooled_cache).eval()
+
+        print(f"✓ Shared encoder loaded with heads for: {list(models.keys())}")
+        return models
+    except Exception as e:
+        print(f"⚠ Warning: Could not load shared encoder, loading separate models: {e}")
+        return {}
+
+def optimize_model(model_name, model):
+    """Fuse, trace and freeze a model for CPU inference; falls back to eager mode on failure"""
+    try:
+        if ipex is not None:
+            model = ipex.optimize(model, dtype=torch.bfloat16, level="O1")
+
+        input_ids = torch.ones((1, MAX_SEQ_LENGTH), dtype=torch.long)
+        attention_mask = torch.ones((1, MAX_SEQ_LENGTH), dtype=torch.long)
+        with torch.no_grad(), torch.autocast("cpu", dtype=torch.bfloat16, enabled=USE_BF16):
+            traced = torch.jit.trace(model, (input_ids, attention_mask), strict=False)
+            traced = torch.jit.freeze(traced)
+            # Warmup runs trigger the fusion passes
+            for _ in range(2):
+                traced(input_ids, attention_mask)
+        print(f"✓ {model_name} model traced ({'ipex bf16' if USE_BF16 else 'int8'})")
+        return traced
+    except Exception as e:
+        print(f"⚠ Warning: Could not optimize {model_name} model, using eager mode: {e}")
+        return model
+
+@lru_cache(maxsize=4096)
+def tokenize(tokenizer, text: str):
+    """Tokenize one input to (1, MAX_SEQ_LENGTH) tensors; cached since medicine names repeat"""
+    # Traced models are shape-specialized, so always pad to the traced length
+    encoded = tokenizer(text, return_tensors="pt", truncation=True, padding="max_length", max_length=MAX_SEQ_LENGTH)
+    return encoded["input_ids"], encoded["attention_mask"]
+
+def classify_batch(model, tokenizer, label_encoder, texts: List[str]) -> List[str]:
     if model is None or tokenizer is None or label_encoder is None:
-        return "Model not available"
-    
-    inputs = tokenizer(text, return_tensors="pt", truncation=True, padding=True, max_length=512)
-    with torch.no_grad():
-        outputs = model(**inputs)
-        logits = outputs.logits
-        predicted_class = logits.argmax(dim=1).item()
-    return label_encoder.inverse_transform([predicted_class])[0]
-
-def simplify_remedies_with_gemini(disease: str, remedies: List[str], yoga_links: List[str]) -> List[dict]:
+        return ["Model not available"] * len(texts)
+
+    encoded = [tokenize(tokenizer, text) for text in texts]
+    input_ids = torch.cat([ids for ids, _ in encoded])
+    attention_mask = torch.cat([mask for _, mask in encoded])
+    with torch.autocast("cpu", dtype=torch.bfloat16, enabled=USE_BF16):
+        # Traced modules only take positional inputs and return (logits,)
+        logits = model(input_ids, attention_mask)[0]
+        predicted_classes = logits.argmax(dim=1).tolist()
+    return [str(label) for label in label_encoder.inverse_transform(predicted_classes)]
+
+def warmup_models(runs: int = 3):
+    """Run dummy forwards at batch size 1 and MAX_BATCH_SIZE so JIT profiling and fusion happen before traffic"""
+    tokenizer = models_cache.get("tokenizer")
+    if tokenizer is None:
+        return
+    input_ids, attention_mask = tokenize(tokenizer, "warmup")
+    for model_key in BATCHED_MODELS:
+        model = models_cache.get(model_key)
+        if model is None:
+            continue
+        try:
+            # Shared-encoder heads would serve repeat runs from their pooled cache and skip the encoder
+            pooled_cache = getattr(model, "pooled_cache", None)
+            with torch.autocast("cpu", dtype=torch.bfloat16, enabled=USE_BF16):
+                for batch_size in (1, MAX_BATCH_SIZE):
+                    for _ in range(runs):
+                        if pooled_cache is not None:
+                            pooled_cache.clear()
+                        model(input_ids.repeat(batch_size, 1), attention_mask.repeat(batch_size, 1))
+            if pooled_cache is not None:
+                pooled_cache.clear()
+            print(f"✓ {model_key} warmed up")
+        except Exception as e:
+            print(f"⚠ Warning: {model_key} warmup failed: {e}")
+
+async def batch_loop(queue: asyncio.Queue, model_key: str):
+    """Coalesce concurrent classification requests into a single forward pass"""
+    loop = asyncio.get_running_loop()
+    while True:
+        items = [await queue.get()]
+        deadline = loop.time() + MAX_BATCH_DELAY
+        while len(items) < MAX_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                items.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        texts = [text for text, _ in items]
+        try:
+            results = await loop.run_in_executor(
+                ml_executor,
+                classify_batch,
+                models_cache.get(model_key),
+                models_cache.get("tokenizer"),
+                models_cache.get(BATCHED_MODELS[model_key]),
+                texts,
+            )
+        except Exception as e:
+            print(f"❌ Error in {model_key} batch of {len(texts)}: {e}")
+            results = [e] * len(items)
+
+        for (_, response_q), result in zip(items, results):
+            response_q.put_nowait(result)
+
+async def classify_queued(model_key: str, text: str) -> str:
+    """Submit text to the model's batching queue and wait for its label"""
+    response_q = asyncio.Queue(maxsize=1)
+    await batch_queues[model_key].put((text, response_q))
+    result = await response_q.get()
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+def cache_key(kind: str, payload: str) -> str:
+    return hashlib.sha256(f"{kind}|{payload}".encode("utf-8")).hexdigest()
+
+async def single_flight(cache, key, compute):
+    """Return the cached value for key, computing it once even if identical requests overlap"""
+    cached = cache.get(key, _MISSING)
+    if cached is not _MISSING:
+        return cached
+
+    # [lock, number of callers holding or waiting on it]; dropped only when the last caller leaves
+    entry = inflight_locks.get(key)
+    if entry is None:
+        entry = inflight_locks[key] = [asyncio.Lock(), 0]
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            cached = cache.get(key, _MISSING)
+            if cached is not _MISSING:
+                return cached
+            # Exceptions propagate without caching, so failures are retried next time
+            result = await compute()
+            cache[key] = result
+            return result
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            del inflight_locks[key]
+
+async def classify_cached(model_key: str, text: str) -> str:
+    # BERT is uncased, so case and surrounding whitespace never change the label
+    key = (model_key, text.strip().lower())
+    return await single_flight(classify_cache, key, lambda: classify_queued(model_key, text))
+
+async def generate_gemini_text(kind: str, prompt: str) -> str:
+    async def compute():
+        response = await models_cache["gemini_model"].generate_content_async(prompt)
+        return response.text.strip()
+
+    return await single_flight(gemini_cache, cache_key(kind, prompt), compute)
+
+async def stream_gemini_lines(prompt: str, model_key: str = "gemini_model"):
+    """Yield complete lines of a streamed Gemini response as soon as each one arrives"""
+    response = await models_cache[model_key].generate_content_async(prompt, stream=True)
+    # Close the chunk stream explicitly so an early stop by the caller ends the upstream request
+    async with aclosing(aiter(response)) as chunks:
+        buffer = ""
+        async for chunk in chunks:
+            buffer += chunk.text
+            *lines, buffer = buffer.split("\n")
+            for line in lines:
+                yield line
+        if buffer:
+            yield buffer
+
+async def generate_gemini_items(kind: str, prompt: str, limit: int, model_key: str = "gemini_model") -> List[str]:
+    """Stream a numbered list from Gemini, parsing items as lines arrive and stopping after limit items"""
+    async def compute():
+        items = []
+        async with aclosing(stream_gemini_lines(prompt, model_key)) as lines:
+            async for line in lines:
+                clean = NUMBERING_PREFIX.sub("", line, count=1).strip()
+                if len(clean) > 10:
+                    items.append(clean)
+                    if len(items) >= limit:
+                        break
+        return items
+
+    return await single_flight(gemini_cache, cache_key(kind, prompt), compute)
+
+async def simplify_remedies_with_gemini(disease: str, remedies: List[str], yoga_links: List[str]) -> List[dict]:
     """Simplify and format database remedies using Gemini AI"""
     try:
-        if "gemini_model" not in models_cache or models_cache["gemini_model"] is None:
+        if models_cache.get("simplifier_model") is None:
             print("⚠ Gemini model not available, returning original remedies")
             return [{"remedy": r, "yoga_link": y} for r, y in zip(remedies, yoga_links)]
 
         # Prepare remedies text
         remedies_text = "\n".join([f"{i+1}. {r}" for i, r in enumerate(remedies)])
 
+        # Only the variable part is sent; the instructions live in the simplifier model's system prompt
         context = f"""
-You are a medical content simplifier. I have some home remedies from a traditional database for '{disease}'.
-Your task: Rewrite these remedies to be:
-- Clear and concise (one sentence each)
-- Easy to understand
-- Action-oriented (start with verbs like "Drink", "Apply", "Mix", etc.)
-- Keep the same meaning and ingredients
+Health issue: '{disease}'
+Number of remedies: {len(remedies)}
 
 Original remedies:
 {remedies_text}
-
-Return EXACTLY {len(remedies)} simplified remedies in this format:
-1. [simplified remedy 1]
-2. [simplified remedy 2]
-3. [simplified remedy 3]
-...
-
-DO NOT add extra remedies. DO NOT add explanations. Just the numbered list.
 """
-        response = models_cache["gemini_model"].generate_content(context)
-        text = response.text.strip()
-        
-        simplified = []
-        for line in text.split("\n"):
-            clean = line.strip()
-            # Remove numbering
-            for prefix in ["1.", "2.", "3.", "4.", "5.", "6.", "7.", "8.", "9.", "10.", "1)", "2)", "3)", "4)", "5)", "-", "•", "*"]:
-                if clean.startswith(prefix):
-                    clean = clean[len(prefix):].strip()
-                    break
-            
-            if len(clean) > 10:
-                simplified.append(clean)
+        simplified = await generate_gemini_items("simplify", context, len(remedies), model_key="simplifier_model")
 
         # Match simplified remedies with yoga links
         result = []
@@ -199,7 +731,7 @@ DO NOT add extra remedies. DO NOT add explanations. Just the numbered list.
         return [{"remedy": r, "yoga_link": y} for r, y in zip(remedies, yoga_links)]
 
 
-def get_remedies_from_gemini(disease: str, df: pd.DataFrame) -> List[dict]:
+async def get_remedies_from_gemini(disease: str, df: pd.DataFrame) -> List[dict]:
     """Generate AI-based remedies using Gemini (only when no database match)"""
     try:
         if "gemini_model" not in models_cache or models_cache["gemini_model"] is None:
@@ -225,23 +757,10 @@ Each remedy should be:
 
 Format: Just list the remedies numbered 1-5, one per line.
 """
-        response = models_cache["gemini_model"].generate_content(context)
-        text = response.text.strip()
-        
-        remedies = []
-        for line in text.split("\n"):
-            clean = line.strip()
-            # Remove numbering
-            for prefix in ["1.", "2.", "3.", "4.", "5.", "1)", "2)", "3)", "4)", "5)", "-", "•", "*"]:
-                if clean.startswith(prefix):
-                    clean = clean[len(prefix):].strip()
-                    break
-            
-            if len(clean) > 10:
-                remedies.append({
-                    "remedy": clean,
-                    "yoga_link": None
-                })
+        remedies = [
+            {"remedy": clean, "yoga_link": None}
+            for clean in await generate_gemini_items("generate", context, 5)
+        ]
 
         # Ensure exactly 5 remedies
         if len(remedies) < 5:
@@ -281,12 +800,7 @@ async def predict_usage(request: MedicineRequest):
         if models_cache.get("pred_model") is None:
             raise HTTPException(status_code=503, detail="Prediction model not loaded")
         
-        result = classify_text(
-            models_cache["pred_model"],
-            models_cache["tokenizer"],
-            models_cache["le_pred"],
-            request.medicine_name,
-        )
+        result = await classify_cached("pred_model", request.medicine_name)
         return {"usage": result}
     except HTTPException:
         raise
@@ -300,12 +814,7 @@ async def predict_side_effects(request: MedicineRequest):
         if models_cache.get("side_model") is None:
             raise HTTPException(status_code=503, detail="Side effects model not loaded")
         
-        effects = classify_text(
-            models_cache["side_model"],
-            models_cache["tokenizer"],
-            models_cache["le_side"],
-            request.medicine_name,
-        )
+        effects = await classify_cached("side_model", request.medicine_name)
         return {"side_effects": [e.strip() for e in effects.split(",")]}
     except HTTPException:
         raise
@@ -319,12 +828,7 @@ async def predict_substitutes(request: MedicineRequest):
         if models_cache.get("sub_model") is None:
             raise HTTPException(status_code=503, detail="Substitute model not loaded")
         
-        subs = classify_text(
-            models_cache["sub_model"],
-            models_cache["tokenizer"],
-            models_cache["le_sub"],
-            request.medicine_name,
-        )
+        subs = await classify_cached("sub_model", request.medicine_name)
         return {"substitutes": [s.strip() for s in subs.split(",")]}
     except HTTPException:
         raise
@@ -349,47 +853,67 @@ async def search_remedies(request: RemedyRequest):
         print(f"📝 Normalized search term: '{term}'")
         print(f"📊 Total rows in database: {len(df)}")
 
+        exact_idx = models_cache.get("remedy_exact_idx", {})
+        word_idx = models_cache.get("remedy_word_idx", {})
+        filtered = df.iloc[0:0]
+
         # Strategy 1: Exact match
-        filtered = df[df["Health Issue"] == term]
+        rows = exact_idx.get(term)
+        if rows is not None:
+            filtered = df.take(rows)
         print(f"Strategy 1 (Exact): Found {len(filtered)} matches")
 
-        # Strategy 2: Contains
+        # Strategy 2: Contains the full term
         if filtered.empty:
-            filtered = df[df["Health Issue"].str.contains(term, case=False, na=False, regex=False)]
+            rows = find_issue_rows(term)
+            if rows.size:
+                filtered = df.take(rows)
             print(f"Strategy 2 (Contains): Found {len(filtered)} matches")
 
-        # Strategy 3: Word-based search
+        # Strategy 3: All words present, in any order (multi-word terms only)
+        words = issue_words(term)
+        if filtered.empty and len(words) > 1:
+            postings = [word_idx.get(w) for w in words]
+            if all(p is not None for p in postings):
+                rows = reduce(np.intersect1d, postings)
+                if len(rows):
+                    filtered = df.take(rows)
+            print(f"Strategy 3 (All words): Found {len(filtered)} matches")
+
+        # Strategy 4: Any single word, whole words first, then partial (e.g. "diabet")
         if filtered.empty:
-            words = term.split()
-            print(f"Strategy 3 (Words): Searching for words: {words}")
+            print(f"Strategy 4 (Words): Searching for words: {words}")
             for w in words:
-                if len(w) > 2:
-                    m = df[df["Health Issue"].str.contains(w, case=False, na=False, regex=False)]
-                    if not m.empty:
-                        filtered = m
-                        print(f"  Found {len(m)} matches for word '{w}'")
-                        break
+                if len(w) > 2 and w in word_idx:
+                    filtered = df.take(word_idx[w])
+                    print(f"  Found {len(filtered)} matches for word '{w}'")
+                    break
+            if filtered.empty:
+                for w in words:
+                    if len(w) > 2:
+                        rows = find_issue_rows(w)
+                        if rows.size:
+                            filtered = df.take(rows)
+                            print(f"  Found {len(filtered)} matches for partial word '{w}'")
+                            break
 
         # --- Return database remedies if found ---
         if not filtered.empty:
             print(f"✅ SUCCESS: Found {len(filtered)} database remedies")
             
-            # Extract remedies and yoga links
-            original_remedies = []
-            yoga_links = []
-            
-            for idx, row in filtered.iterrows():
-                remedy_text = str(row["Home Remedy"]).strip()
-                original_remedies.append(remedy_text)
-                
-                yoga_link = str(row["Yogasan"]) if pd.notna(row["Yogasan"]) and str(row["Yogasan"]).strip() else None
-                yoga_links.append(yoga_link)
-                
-                print(f"  Original remedy {len(original_remedies)}: {remedy_text[:50]}...")
+            # Extract remedies and yoga links column-wise
+            original_remedies = filtered["Home Remedy"].astype(str).str.strip().tolist()
+            yoga = filtered["Yogasan"]
+            yoga_text = yoga.astype(str)
+            has_yoga = yoga.notna() & (yoga_text.str.strip() != "")
+            yoga_links = yoga_text.astype(object).where(has_yoga, None).tolist()
+
+            for i, remedy_text in enumerate(original_remedies, start=1):
+                print(f"  Original remedy {i}: {remedy_text[:50]}...")
 
             # Simplify remedies using Gemini AI
             print("🤖 Sending database remedies to Gemini for simplification...")
-            simplified_remedies = simplify_remedies_with_gemini(request.disease, original_remedies, yoga_links)
+            simplified_remedies = await simplify_remedies_with_gemini(request.disease, original_remedies, yoga_links)
 
             response = {
                 "disease": request.disease,
@@ -402,7 +926,7 @@ async def search_remedies(request: RemedyRequest):
 
         # --- Otherwise use AI ---
         print("⚠️  No database match found, generating AI remedies...")
-        ai_remedies = get_remedies_from_gemini(request.disease, df)
+        ai_remedies = await get_remedies_from_gemini(request.disease, df)
         print(f"🤖 Generated {len(ai_remedies)} AI remedies")
 
         response = {
@@ -429,19 +953,8 @@ async def chat(request: ChatRequest):
         if "gemini_model" not in models_cache or models_cache["gemini_model"] is None:
             raise HTTPException(status_code=503, detail="Gemini AI not configured")
 
-        context = """
-        You are an AI medical assistant (not a doctor).
-        Provide:
-        - Likely diseases (max 2)
-        - Suggested diet
-        - Recommended workouts
-        - Precautions
-        End with: "Consult a doctor for professional advice."
-        """
-
-        prompt = f"{context}\n\nUser's query: {request.message}"
-        response = models_cache["gemini_model"].generate_content(prompt)
-        return {"response": response.text.strip()}
+        prompt = f"{CHAT_CONTEXT}\n\nUser's query: {request.message}"
+        return {"response": await generate_gemini_text("chat", prompt)}
 
     except HTTPException:
         raise
@@ -449,6 +962,42 @@ async def chat(request: ChatRequest):
         print(f"Error in chat: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """Stream the chat answer as Server-Sent Events while Gemini generates it
+
+    Only completed answers are cached; unlike /api/chat, identical requests that
+    overlap before the first one finishes are not coalesced and each call Gemini.
+    """
+    if "gemini_model" not in models_cache or models_cache["gemini_model"] is None:
+        raise HTTPException(status_code=503, detail="Gemini AI not configured")
+
+    prompt = f"{CHAT_CONTEXT}\n\nUser's query: {request.message}"
+    key = cache_key("chat", prompt)
+
+    async def event_stream():
+        cached = gemini_cache.get(key)
+        if cached is not None:
+            yield f"data: {json.dumps({'text': cached})}\n\n"
+            yield "event: done\ndata: {}\n\n"
+            return
+
+        try:
+            parts = []
+            response = await models_cache["gemini_model"].generate_content_async(prompt, stream=True)
+            # Close the chunk stream explicitly so a client disconnect ends the upstream request
+            async with aclosing(aiter(response)) as chunks:
+                async for chunk in chunks:
+                    parts.append(chunk.text)
+                    yield f"data: {json.dumps({'text': chunk.text})}\n\n"
+            gemini_cache[key] = "".join(parts).strip()
+            yield "event: done\ndata: {}\n\n"
+        except Exception as e:
+            print(f"Error in chat_stream: {e}")
+            yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
 # --- Run the API ---
 if __name__ == "__main__":
     import uvicorn